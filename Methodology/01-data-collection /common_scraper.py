@@ -0,0 +1,334 @@
+"""
+Shared Scraper Utilities
+
+Helpers used by more than one of the scrapers in this directory. The scrapers
+are run as scripts from here, so they import this module by name:
+
+    from common_scraper import TokenBucket
+"""
+
+import os
+import sys
+import shutil
+import time
+import queue
+import atexit
+import logging
+import threading
+import orjson
+import requests
+import ahocorasick
+from logging.handlers import QueueHandler, QueueListener
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Worker threads per pool in the threaded scrapers; the connection pool below is sized from it
+MAX_WORKERS = 8
+
+# (connect, read) timeouts in seconds so a stalled connection can't hang a worker
+TIMEOUT = (5, 60)
+
+
+def make_retry(raise_on_status=True):
+    """Retry policy shared by every scraper session: GETs retried on connection errors, 429 and 5xx"""
+    return Retry(
+        total=5,
+        connect=3,
+        read=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=['GET'],
+        # Wait as long as a 429/503 asks before trying again
+        respect_retry_after_header=True,
+        # False hands the last response back to callers that check status codes themselves
+        raise_on_status=raise_on_status
+    )
+
+
+def make_session(pool_size, raise_on_status=True):
+    """Session with pooled keep-alive connections, make_retry() and every content encoding urllib3 can decode"""
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(
+        pool_connections=pool_size,
+        # Room for every worker per host, so no connection is thrown away after use;
+        # block rather than open extra connections if that is ever exceeded
+        pool_maxsize=pool_size * 2,
+        pool_block=True,
+        max_retries=make_retry(raise_on_status)
+    ))
+    # gzip and deflate, plus br/zstd when their decoders are installed
+    session.headers.update(make_headers(accept_encoding=True))
+    return session
+
+
+# Shared HTTP session so every request reuses pooled keep-alive connections
+SESSION = make_session(MAX_WORKERS)
+
+# Read and write images in 1 MiB blocks rather than 1 KiB
+CHUNK_SIZE = 1024 * 1024
+# Most bytes (or buffers) to let pile up behind a slow disk write before waiting for it
+WRITE_BATCH_SIZE = 8 * 1024 * 1024
+WRITE_BATCH_BUFFERS = 512
+# Threads that write downloaded batches so slow disks don't stall socket reads
+DISK_POOL = ThreadPoolExecutor(max_workers=4)
+
+
+def setup_logging(level=logging.INFO):
+    """Log to stdout from one listener thread; worker threads only put records on a queue"""
+    log_queue = queue.Queue()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    listener = QueueListener(log_queue, handler)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(QueueHandler(log_queue))
+    # Keep urllib3's per-connection debug chatter out of --verbose output
+    logging.getLogger('urllib3').setLevel(logging.WARNING)
+
+    listener.start()
+    # Write out whatever is still queued when the script exits
+    atexit.register(listener.stop)
+    return listener
+
+
+class TokenBucket:
+    """Thread-safe rate limiter allowing bursts of `capacity` requests and `rate` per second sustained"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+class MetadataWriter:
+    """Serialize records and append them as JSON lines from a background thread, in batches"""
+
+    _STOP = object()
+
+    def __init__(self, path, batch_size=100, flush_interval=1.0, max_pending=1024):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Bounded so a stalled disk slows the workers down instead of piling up memory
+        self.queue = queue.Queue(maxsize=max_pending)
+        # Set by the writer thread if the file can't be opened or written
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, record):
+        """Queue one record; serializing and writing it happen on the writer thread"""
+        if not self._put(record):
+            raise RuntimeError(f"Metadata writer for {self.path} has stopped") from self.error
+
+    def close(self):
+        """Write out everything still queued and stop the writer thread"""
+        # A dead writer has already logged why; there is nothing left to flush
+        self._put(self._STOP)
+        self.thread.join()
+
+    def _put(self, item):
+        """Queue an item, giving up once the writer thread is gone so callers never block forever"""
+        while self.thread.is_alive():
+            try:
+                self.queue.put(item, timeout=self.flush_interval)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        try:
+            with open(self.path, 'ab') as f:
+                batch = []
+                last_flush = time.monotonic()
+                while True:
+                    try:
+                        record = self.queue.get(timeout=self.flush_interval)
+                    except queue.Empty:
+                        record = None
+                    if record is self._STOP:
+                        break
+                    if record is not None:
+                        try:
+                            batch.append(orjson.dumps(record) + b'\n')
+                        except TypeError as e:
+                            # Drop the one record rather than stopping the thread every worker feeds
+                            logger.warning("Could not serialize metadata record: %s", e)
+
+                    # Write every batch_size records, or every flush_interval seconds when trickling in
+                    now = time.monotonic()
+                    if batch and (len(batch) >= self.batch_size or now - last_flush >= self.flush_interval):
+                        f.write(b''.join(batch))
+                        f.flush()
+                        batch = []
+                        last_flush = now
+
+                if batch:
+                    f.write(b''.join(batch))
+        except OSError as e:
+            self.error = e
+            logger.error("Metadata writer for %s stopped: %s", self.path, e)
+
+
+def compile_excluded_terms(terms):
+    """Build an Aho-Corasick automaton that finds every excluded term in one pass over lowercased text"""
+    automaton = ahocorasick.Automaton()
+    for term in terms:
+        if term:
+            automaton.add_word(term.lower(), term)
+    automaton.make_automaton()
+    return automaton
+
+
+def find_excluded_term(automaton, text):
+    """Return the first excluded term found in `text`, or None"""
+    # With no terms added there is nothing to search for
+    if automaton.kind != ahocorasick.AHOCORASICK:
+        return None
+    for _, term in automaton.iter(text):
+        return term
+    return None
+
+
+# Anything smaller than this is an error page or a cut-off transfer, not an image
+MIN_IMAGE_BYTES = 512
+
+
+def write_chunks(f, chunks):
+    """Write byte chunks to an unbuffered file, in one vectored syscall where available"""
+    buffers = [memoryview(chunk) for chunk in chunks]
+    while buffers:
+        if hasattr(os, 'writev'):
+            written = os.writev(f.fileno(), buffers)
+        else:
+            written = f.write(buffers[0])
+        # Drop whatever the kernel accepted; a short write leaves the tail of one buffer
+        while buffers and written >= len(buffers[0]):
+            written -= len(buffers[0])
+            buffers.pop(0)
+        if written:
+            buffers[0] = buffers[0][written:]
+
+
+def save_stream(response, path):
+    """Stream a response body to path, writing on DISK_POOL while the next chunks download"""
+    # Same .part-and-rename as download_image, so a failed transfer never leaves a partial image at `path`
+    part_path = os.fspath(path) + '.part'
+    try:
+        with open(part_path, 'wb', buffering=0) as f:
+            batch, batch_size = [], 0
+            pending_write = None
+            try:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    batch.append(chunk)
+                    batch_size += len(chunk)
+                    # Hand over whatever arrived as soon as the disk is free, from the first chunk on;
+                    # chunks pile up into one vectored write only while the previous write is running
+                    full = batch_size >= WRITE_BATCH_SIZE or len(batch) >= WRITE_BATCH_BUFFERS
+                    if pending_write is None or pending_write.done() or full:
+                        # Keep one write in flight per file so batches land in order
+                        if pending_write:
+                            pending_write.result()
+                        pending_write = DISK_POOL.submit(write_chunks, f, batch)
+                        batch, batch_size = [], 0
+            finally:
+                # Never close the file underneath a write that is still running
+                if pending_write:
+                    pending_write.result()
+            if batch:
+                write_chunks(f, batch)
+            written = f.tell()
+        if written < MIN_IMAGE_BYTES:
+            raise IOError(f"truncated download ({written} bytes)")
+        os.replace(part_path, path)
+    finally:
+        # Left over only when the download failed
+        if os.path.exists(part_path):
+            os.unlink(part_path)
+
+
+def download_image(url, path, *, bucket=None, headers=None):
+    """Stream an image from `url` to `path` through the shared session; return True on success"""
+    # Write to a side file and rename it into place, so `path` only ever holds a complete image
+    part_path = path + '.part'
+    try:
+        if bucket is not None:
+            bucket.acquire()
+        with SESSION.get(url, stream=True, headers=headers, timeout=TIMEOUT) as response:
+            response.raise_for_status()
+            # Copy straight from the socket in 1 MiB reads, decoding any gzip/deflate
+            response.raw.decode_content = True
+            with open(part_path, 'wb') as f:
+                shutil.copyfileobj(response.raw, f, length=1024 * 1024)
+                written = f.tell()
+        if written < MIN_IMAGE_BYTES:
+            raise IOError(f"truncated download ({written} bytes)")
+        os.replace(part_path, path)
+        return True
+    except Exception as e:
+        logger.warning("Error downloading image %s: %s", url, e)
+        return False
+    finally:
+        # Left over only when the download failed
+        if os.path.exists(part_path):
+            os.unlink(part_path)
+
+
+def warm_up(session, urls, timeout=5):
+    """Send a HEAD to each host so DNS is resolved and a TLS connection is pooled before workers start"""
+    for url in urls:
+        try:
+            session.head(url, timeout=timeout)
+        except requests.exceptions.RequestException:
+            # A failed warm-up only means the first real request pays the setup cost
+            pass
+
+
+def list_downloaded_files(directory):
+    """Return the names of the non-empty files in `directory`, read with one scandir"""
+    with os.scandir(directory) as entries:
+        return {entry.name for entry in entries if entry.is_file() and entry.stat().st_size > 0}
+
+
+def load_jsonl_ids(path, key):
+    """Return the set of `key` values, as strings, recorded in a JSONL metadata file"""
+    ids = set()
+    if not os.path.exists(path):
+        return ids
+
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                ids.add(str(orjson.loads(line)[key]))
+            except (ValueError, KeyError):
+                # Skip a line left truncated by an interrupted run
+                continue
+
+    return ids
@@ -1,9 +1,20 @@
-import requests
 import os
-import json
-import time
-import random
-from datetime import datetime
+import orjson
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from common_scraper import TIMEOUT, TokenBucket, load_jsonl_ids, make_session, save_stream, setup_logging
+
+logger = logging.getLogger(__name__)
+
+class SafeFilenameTable(dict):
+    """str.translate table mapping non-alphanumeric characters to "_", filled in on first use"""
+    def __missing__(self, codepoint):
+        char = chr(codepoint)
+        replacement = char if char.isalnum() else "_"
+        self[codepoint] = replacement
+        return replacement
+
+SAFE_FILENAME_TABLE = SafeFilenameTable()
 
 class CooperHewittScraper:
     def __init__(self, api_key):
@@ -11,13 +22,28 @@ class CooperHewittScraper:
         self.base_url = "https://api.collection.cooperhewitt.org/rest/"
         self.output_dir = "cooper_hewitt_clouds"
         
+        # Reuse connections to the API and image hosts; the last response comes back
+        # instead of raising so the status checks below still apply
+        self.session = make_session(16, raise_on_status=False)
+        
+        # Only slow down when API calls actually outpace 10 per second
+        self.bucket = TokenBucket(rate=10, capacity=10)
+        
+        # Workers for image lookups that are issued side by side
+        self.lookup_pool = ThreadPoolExecutor(max_workers=4)
+        
         # Create output directories if they don't exist
-        if not os.path.exists(self.output_dir):
-            os.makedirs(self.output_dir)
-        if not os.path.exists(f"{self.output_dir}/images"):
-            os.makedirs(f"{self.output_dir}/images")
-        if not os.path.exists(f"{self.output_dir}/metadata"):
-            os.makedirs(f"{self.output_dir}/metadata")
+        os.makedirs(f"{self.output_dir}/images", exist_ok=True)
+        os.makedirs(f"{self.output_dir}/metadata", exist_ok=True)
+        os.makedirs(f"{self.output_dir}/cache", exist_ok=True)
+        
+        # IDs recorded under any query so far, so overlapping queries skip shared objects
+        self.seen_ids = set()
+        for name in os.listdir(f"{self.output_dir}/metadata"):
+            if name.endswith(".jsonl"):
+                self.seen_ids |= load_jsonl_ids(f"{self.output_dir}/metadata/{name}", "id")
+        if self.seen_ids:
+            logger.info("Found %s objects already recorded in %s/metadata", len(self.seen_ids), self.output_dir)
             
     def search_objects(self, query, page=1, per_page=100):
         """Search for objects based on query - with broader parameters"""
@@ -33,16 +59,17 @@ class CooperHewittScraper:
             "sort": "relevance"
         }
         
-        response = requests.get(self.base_url, params=params)
+        self.bucket.acquire()
+        response = self.session.get(self.base_url, params=params, timeout=TIMEOUT)
         
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             total = data.get("total", 0)
-            print(f"Found {total} total results for query '{query}'")
+            logger.info("Found %s total results for query '%s'", total, query)
             return data
         else:
-            print(f"Error searching objects: {response.status_code}")
-            print(response.text)
+            logger.error("Error searching objects: %s", response.status_code)
+            logger.error("Response: %s", response.text)
             return None
     
     def try_alternate_search(self, query, page=1, per_page=100):
@@ -75,38 +102,66 @@ class CooperHewittScraper:
         ]
         
         for params in methods:
-            print(f"Trying alternate search method: {params['method']}")
+            logger.info("Trying alternate search method: %s", params['method'])
             try:
-                response = requests.get(self.base_url, params=params)
+                self.bucket.acquire()
+                response = self.session.get(self.base_url, params=params, timeout=TIMEOUT)
                 if response.status_code == 200:
-                    data = response.json()
+                    data = orjson.loads(response.content)
                     if "objects" in data and len(data["objects"]) > 0:
-                        print(f"Found {len(data['objects'])} objects with method {params['method']}")
+                        logger.info("Found %s objects with method %s", len(data['objects']), params['method'])
                         return data
             except Exception as e:
-                print(f"Error with alternate search method: {e}")
+                logger.warning("Error with alternate search method: %s", e)
                 continue
         
         return None
     
     def get_object_details(self, object_id):
-        """Get detailed information about a specific object"""
+        """Get detailed information about a specific object, revalidating any cached copy"""
         params = {
             "method": "cooperhewitt.objects.getInfo",
             "access_token": self.api_key,
             "object_id": object_id
         }
         
-        response = requests.get(self.base_url, params=params)
+        # Cached response body plus the ETag/Last-Modified validators it was served with
+        cache_path = f"{self.output_dir}/cache/{object_id}.json"
+        etag_path = f"{self.output_dir}/cache/{object_id}.etag"
         
-        if response.status_code == 200:
-            return response.json()
+        headers = {}
+        if os.path.exists(cache_path) and os.path.exists(etag_path):
+            with open(etag_path, 'rb') as f:
+                validators = orjson.loads(f.read())
+            if validators.get("ETag"):
+                headers["If-None-Match"] = validators["ETag"]
+            if validators.get("Last-Modified"):
+                headers["If-Modified-Since"] = validators["Last-Modified"]
+        
+        self.bucket.acquire()
+        response = self.session.get(self.base_url, params=params, headers=headers, timeout=TIMEOUT)
+        
+        if response.status_code == 304:
+            # Unchanged since the last run, reuse the cached body
+            with open(cache_path, 'rb') as f:
+                return orjson.loads(f.read())
+        elif response.status_code == 200:
+            validators = {
+                "ETag": response.headers.get("ETag"),
+                "Last-Modified": response.headers.get("Last-Modified")
+            }
+            if validators["ETag"] or validators["Last-Modified"]:
+                with open(cache_path, 'wb') as f:
+                    f.write(response.content)
+                with open(etag_path, 'wb') as f:
+                    f.write(orjson.dumps(validators))
+            return orjson.loads(response.content)
         else:
-            print(f"Error getting object details: {response.status_code}")
+            logger.warning("Error getting object details: %s", response.status_code)
             return None
     
     def try_get_images(self, object_id):
-        """Try multiple methods to get images for an object"""
+        """Try multiple methods to get images for an object, all at once"""
         methods = [
             # Standard method
             {
@@ -122,20 +177,34 @@ class CooperHewittScraper:
             }
         ]
         
-        for params in methods:
-            try:
-                print(f"Trying to get images with method: {params['method']}")
-                response = requests.get(self.base_url, params=params)
-                if response.status_code == 200:
-                    data = response.json()
-                    # Check for images or media
-                    if "media" in data and data["media"]:
-                        return data["media"]
-                    if "images" in data and data["images"]:
-                        return data["images"]
-            except Exception as e:
-                print(f"Error getting images: {e}")
-                continue
+        # Fire every method concurrently and keep whichever answers first with images
+        pending = {self.lookup_pool.submit(self.fetch_images, params) for params in methods}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                images = future.result()
+                if images:
+                    for other in pending:
+                        other.cancel()
+                    return images
+        
+        return None
+    
+    def fetch_images(self, params):
+        """Call one image lookup method and return its images or media, if any"""
+        try:
+            logger.debug("Trying to get images with method: %s", params['method'])
+            self.bucket.acquire()
+            response = self.session.get(self.base_url, params=params, timeout=TIMEOUT)
+            if response.status_code == 200:
+                data = orjson.loads(response.content)
+                # Check for images or media
+                if "media" in data and data["media"]:
+                    return data["media"]
+                if "images" in data and data["images"]:
+                    return data["images"]
+        except Exception as e:
+            logger.warning("Error getting images: %s", e)
         
         return None
     
@@ -149,9 +218,10 @@ class CooperHewittScraper:
         }
         
         try:
-            response = requests.get(self.base_url, params=params)
+            self.bucket.acquire()
+            response = self.session.get(self.base_url, params=params, timeout=TIMEOUT)
             if response.status_code == 200:
-                data = response.json()
+                data = orjson.loads(response.content)
                 if "url" in data:
                     return data["url"]
         except:
@@ -180,161 +250,178 @@ class CooperHewittScraper:
     
     def get_direct_image_links(self, object_id):
         """Construct direct image links for known patterns"""
-        # Try different direct URL patterns
-        urls = [
+        # Candidates are tried in order by download_image, which fails fast on a miss
+        return [
             f"https://images.collection.cooperhewitt.org/images/{object_id}_large.jpg",
             f"https://collection.cooperhewitt.org/iiif/{object_id}/full/full/0/default.jpg",
             f"https://images.collection.cooperhewitt.org/{object_id}_b.jpg"
         ]
+    
+    def download_image(self, urls, filename):
+        """Download image from the first of the candidate URLs that serves one"""
+        if isinstance(urls, str):
+            urls = [urls]
+        
+        headers = {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+        }
         
         for url in urls:
             try:
-                print(f"Trying direct image URL: {url}")
-                response = requests.head(url)
-                if response.status_code == 200:
+                logger.debug("Attempting to download from: %s", url)
+                with self.session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+                    if response.status_code != 200:
+                        logger.warning("Error downloading image %s: %s", filename, response.status_code)
+                        continue
+                    
+                    # Check if it's actually an image
                     content_type = response.headers.get('Content-Type', '')
-                    if content_type.startswith('image/'):
-                        print(f"Found valid image URL: {url}")
-                        return url
-            except:
+                    if not content_type.startswith('image/'):
+                        logger.warning("URL is not an image. Content-Type: %s", content_type)
+                        continue
+                    
+                    save_stream(response, filename)
+                    return True
+            except Exception as e:
+                logger.warning("Exception while downloading %s: %s", filename, e)
                 continue
         
-        return None
-    
-    def download_image(self, url, filename):
-        """Download image from URL"""
-        try:
-            print(f"Attempting to download from: {url}")
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-            }
-            response = requests.get(url, headers=headers, stream=True)
-            
-            # Check if it's actually an image
-            content_type = response.headers.get('Content-Type', '')
-            if not content_type.startswith('image/'):
-                print(f"URL is not an image. Content-Type: {content_type}")
-                return False
-                
-            if response.status_code == 200:
-                with open(filename, 'wb') as f:
-                    for chunk in response.iter_content(1024):
-                        f.write(chunk)
-                return True
-            else:
-                print(f"Error downloading image {filename}: {response.status_code}")
-                return False
-        except Exception as e:
-            print(f"Exception while downloading {filename}: {e}")
-            return False
+        return False
             
-    def save_metadata(self, object_data, filename):
-        """Save metadata to JSON file"""
+    def save_metadata(self, object_data, metadata_file, image_filename=None):
+        """Append metadata as one line of the open JSONL file, noting its image file (None if there is none)"""
         try:
-            with open(filename, 'w') as f:
-                json.dump(object_data, f, indent=2)
+            record = {**object_data, "image_filename": image_filename}
+            metadata_file.write(orjson.dumps(record) + b"\n")
             return True
         except Exception as e:
-            print(f"Exception while saving metadata {filename}: {e}")
+            logger.error("Exception while saving metadata to %s: %s", metadata_file.name, e)
             return False
-            
+    
+    def metadata_path(self, query):
+        """Path of the JSONL metadata file for a search query"""
+        safe_query = query.translate(SAFE_FILENAME_TABLE)
+        return f"{self.output_dir}/metadata/{safe_query}.jsonl"
+    
+    def split_metadata(self, query="cloud"):
+        """Write each record of a query's JSONL metadata out as its own JSON file"""
+        jsonl_path = self.metadata_path(query)
+        split_dir = os.path.splitext(jsonl_path)[0]
+        os.makedirs(split_dir, exist_ok=True)
+        
+        count = 0
+        with open(jsonl_path, 'rb') as f:
+            for line in f:
+                try:
+                    record = orjson.loads(line)
+                except ValueError:
+                    continue
+                # Objects saved without an image keep the old "_noimage" suffix
+                suffix = "" if record.get("image_filename") else "_noimage"
+                with open(f"{split_dir}/{record['id']}{suffix}.json", 'wb') as out:
+                    out.write(orjson.dumps(record, option=orjson.OPT_INDENT_2))
+                count += 1
+        
+        logger.info("Wrote %s metadata files to %s", count, split_dir)
+        return count
+    
     def scrape(self, query="cloud", max_pages=10):
         """Main scraping function"""
-        print(f"Starting scrape for query: '{query}'")
+        logger.info("Starting scrape for query: '%s'", query)
         
         total_downloaded = 0
         current_page = 1
         
-        while current_page <= max_pages:
-            print(f"Processing page {current_page}...")
+        # One append-only metadata file per query instead of one file per object
+        jsonl_path = self.metadata_path(query)
+        
+        with open(jsonl_path, 'ab', buffering=1 << 20) as metadata_file:
+            while current_page <= max_pages:
+                logger.info("Processing page %s...", current_page)
             
-            # Try regular search first
-            search_results = self.search_objects(query, page=current_page)
+                # Try regular search first
+                search_results = self.search_objects(query, page=current_page)
             
-            if not search_results or "objects" not in search_results or len(search_results["objects"]) == 0:
-                print("No results from standard search, trying alternate methods...")
-                search_results = self.try_alternate_search(query, page=current_page)
-                
-            if not search_results or "objects" not in search_results:
-                print("No more results or error in API response")
-                break
-                
-            if len(search_results["objects"]) == 0:
-                print("No more objects found")
-                break
-                
-            for i, obj in enumerate(search_results["objects"]):
-                object_id = obj["id"]
-                print(f"Processing object {i+1}/{len(search_results['objects'])}, ID: {object_id}")
+                if not search_results or "objects" not in search_results or len(search_results["objects"]) == 0:
+                    logger.info("No results from standard search, trying alternate methods...")
+                    search_results = self.try_alternate_search(query, page=current_page)
                 
-                # Get detailed object info
-                object_details = self.get_object_details(object_id)
+                if not search_results or "objects" not in search_results:
+                    logger.info("No more results or error in API response")
+                    break
                 
-                # Save the object data
-                obj_data = object_details["object"] if object_details and "object" in object_details else obj
+                if len(search_results["objects"]) == 0:
+                    logger.info("No more objects found")
+                    break
                 
-                # Try multiple methods to get an image URL
-                image_url = None
+                for i, obj in enumerate(search_results["objects"]):
+                    object_id = obj["id"]
+                    logger.debug("Processing object %s/%s, ID: %s", i+1, len(search_results['objects']), object_id)
+                    
+                    # Skip objects recorded by an earlier run or an earlier query
+                    if str(object_id) in self.seen_ids:
+                        logger.debug("Already processed %s, skipping", object_id)
+                        continue
                 
-                # Method 1: Try to extract from object data
-                if object_details and "object" in object_details:
-                    image_url = self.get_image_from_object(object_details["object"])
+                    # Method 1: Try to extract from the search record, which usually carries images
+                    obj_data = obj
+                    image_url = self.get_image_from_object(obj)
+                    
+                    # Only fetch detailed object info when the search record has no image
+                    if not image_url:
+                        object_details = self.get_object_details(object_id)
+                        if object_details and "object" in object_details:
+                            obj_data = object_details["object"]
+                            image_url = self.get_image_from_object(obj_data)
                 
-                # Method 2: Try specific API methods for images
-                if not image_url:
-                    images_data = self.try_get_images(object_id)
-                    if images_data and isinstance(images_data, list) and images_data:
-                        for img in images_data:
-                            for size in ["b", "z", "n", "d", "l", "o"]:
-                                if size in img and "url" in img[size]:
-                                    image_url = img[size]["url"]
+                    # Method 2: Try specific API methods for images
+                    if not image_url:
+                        images_data = self.try_get_images(object_id)
+                        if images_data and isinstance(images_data, list) and images_data:
+                            for img in images_data:
+                                for size in ["b", "z", "n", "d", "l", "o"]:
+                                    if size in img and "url" in img[size]:
+                                        image_url = img[size]["url"]
+                                        break
+                                if image_url:
                                     break
-                            if image_url:
-                                break
                 
-                # Method 3: Try direct URL patterns
-                if not image_url:
-                    image_url = self.get_direct_image_links(object_id)
-                
-                if not image_url:
-                    print(f"No image URL found for object ID: {object_id}")
+                    # Method 3: Fall back to direct URL patterns, probed by the download itself
+                    image_urls = [image_url] if image_url else self.get_direct_image_links(object_id)
                     
-                    # Save metadata even if no image
+                    # Create sanitized filename from object title
                     title = obj.get("title", "untitled")
-                    safe_title = "".join([c if c.isalnum() else "_" for c in title])
-                    safe_title = safe_title[:50]  # Limit length
-                    metadata_filename = f"{self.output_dir}/metadata/{object_id}_{safe_title}_noimage.json"
-                    self.save_metadata(obj_data, metadata_filename)
-                    
-                    continue
-                    
-                # Create sanitized filename from object title
-                title = obj.get("title", "untitled")
-                safe_title = "".join([c if c.isalnum() else "_" for c in title])
-                safe_title = safe_title[:50]  # Limit length
+                    safe_title = title.translate(SAFE_FILENAME_TABLE)[:50]  # Limit length
                 
-                # File paths
-                image_filename = f"{self.output_dir}/images/{object_id}_{safe_title}.jpg"
-                metadata_filename = f"{self.output_dir}/metadata/{object_id}_{safe_title}.json"
+                    # File paths
+                    image_filename = f"{self.output_dir}/images/{object_id}_{safe_title}.jpg"
                 
-                # Download image
-                if self.download_image(image_url, image_filename):
-                    print(f"Downloaded image: {image_filename}")
+                    # Download image
+                    if self.download_image(image_urls, image_filename):
+                        logger.debug("Downloaded image: %s", image_filename)
                     
-                    # Save metadata
-                    if self.save_metadata(obj_data, metadata_filename):
-                        print(f"Saved metadata: {metadata_filename}")
-                        total_downloaded += 1
-                
-                # Avoid hitting rate limits with randomized delay
-                time.sleep(1 + random.random())
+                        # Save metadata
+                        if self.save_metadata(obj_data, metadata_file, os.path.basename(image_filename)):
+                            logger.debug("Saved metadata to: %s", jsonl_path)
+                            self.seen_ids.add(str(object_id))
+                            total_downloaded += 1
+                    elif not image_url:
+                        logger.debug("No image URL found for object ID: %s", object_id)
+                    
+                        # Save metadata even if no image
+                        if self.save_metadata(obj_data, metadata_file):
+                            self.seen_ids.add(str(object_id))
                 
-            current_page += 1
+                # Push this page's records to disk before fetching the next one
+                metadata_file.flush()
+                current_page += 1
             
-        print(f"Scraping completed. Downloaded {total_downloaded} images with metadata.")
+        logger.info("Scraping completed. Downloaded %s images with metadata.", total_downloaded)
         return total_downloaded
 
 if __name__ == "__main__":
+    setup_logging()
+    
     # You'll need to get an API key from Cooper Hewitt
     API_KEY = "YOUR_API_KEY_HERE"  # Replace with your actual API key
     
@@ -343,7 +430,3 @@ if __name__ == "__main__":
     
     # Run the scraper with multiple search strategies
     scraper.scrape(query="cloud", max_pages=10)
-    scraper = HarvardArtScraper(API_KEY)
-    
-    # Run the scraper
-    scraper.scrape(query="cloud", max_pages=10)
@@ -9,13 +9,18 @@ excluding images related to "saint cloud" or "saint-cloud".
 """
 
 import os
-import json
-import time
-import requests
+import re
+import logging
+import threading
+import ijson
 from urllib.parse import urljoin
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from common_scraper import TIMEOUT, TokenBucket, MetadataWriter, load_jsonl_ids, make_session, save_stream, setup_logging
 import argparse
 
+logger = logging.getLogger(__name__)
+
 
 class EuropeanaCloudScraper:
     """Scraper for downloading cloud images from Europeana."""
@@ -26,15 +31,30 @@ class EuropeanaCloudScraper:
         self.base_url = "https://api.europeana.eu/record/v2/search.json"
         self.search_term = "cloud"
         self.excluded_terms = ["saint cloud", "saint-cloud", "st cloud", "st. cloud"]
+        # All excluded terms as one case-insensitive pattern, scanned in a single pass
+        self._exclude_re = re.compile('|'.join(re.escape(term) for term in self.excluded_terms), re.IGNORECASE)
         self.output_dir = Path(output_dir)
-        self.metadata_file = self.output_dir / "metadata.json"
+        # One JSON record per downloaded image, appended as each download finishes
+        self.metadata_file = self.output_dir / "metadata.jsonl"
         self.rows_per_page = 100  # Maximum allowed by Europeana API
         self.max_images = 1000  # Limit the total number of images to download
-        self.metadata = []
+        self.max_workers = 8  # Parallel image downloads per page
+        
+        # Downloads claimed by workers so far, so parallel workers stop at max_images
+        self._reserved = 0
+        # IDs recorded in metadata_file by earlier runs or claimed in this one; loaded in run()
+        self._seen_ids = set()
+        self._lock = threading.Lock()
+        # Cap the sustained download rate while letting short bursts go out together
+        self._bucket = TokenBucket(rate=5, capacity=10)
+        
+        # Reuse connections to the API and image hosts; the last response comes back
+        # instead of raising so the status checks below still apply
+        self.session = make_session(self.max_workers, raise_on_status=False)
         
         # Create output directory if it doesn't exist
         self.output_dir.mkdir(exist_ok=True, parents=True)
-        print(f"Output directory: {self.output_dir}")
+        logger.info("Output directory: %s", self.output_dir)
     
     def should_exclude_item(self, item):
         """Check if an item contains any of the excluded terms."""
@@ -45,11 +65,10 @@ class EuropeanaCloudScraper:
             item.get('dcCreator', [''])[0] if item.get('dcCreator') else ''
         ]
         
-        combined_text = ' '.join(text_fields).lower()
-        return any(term.lower() in combined_text for term in self.excluded_terms)
+        return bool(self._exclude_re.search(' '.join(text_fields)))
     
     def search_europeana(self, page=1):
-        """Search Europeana API for cloud images."""
+        """Search Europeana API for cloud images, returning the unread streamed response."""
         params = {
             'query': self.search_term,
             'media': 'true',
@@ -60,20 +79,27 @@ class EuropeanaCloudScraper:
             'wskey': self.api_key
         }
         
-        print(f"Fetching page {page}...")
-        response = requests.get(self.base_url, params=params)
+        logger.info("Fetching page %s...", page)
+        response = self.session.get(self.base_url, params=params, stream=True, timeout=TIMEOUT)
         
         if response.status_code != 200:
-            print(f"Error: Received status code {response.status_code}")
-            print(f"Response: {response.text}")
+            logger.error("Error: Received status code %s", response.status_code)
+            logger.error("Response: %s", response.text)
             return None
         
-        return response.json()
+        return response
     
-    async def download_image(self, image_url, item_id, filename=None):
+    def iter_items(self, response):
+        """Yield result items from a streamed search response as they are parsed."""
+        # Let urllib3 undo any gzip/br encoding before ijson sees the bytes
+        response.raw.decode_content = True
+        with response:
+            yield from ijson.items(response.raw, 'items.item', use_float=True)
+    
+    def download_image(self, image_url, item_id, filename=None):
         """Download an image from the given URL."""
         if not image_url:
-            print(f"No image URL provided for item {item_id}")
+            logger.debug("No image URL provided for item %s", item_id)
             return None
         
         try:
@@ -85,117 +111,120 @@ class EuropeanaCloudScraper:
             filepath = self.output_dir / filename
             
             # Download the image
-            response = requests.get(image_url, stream=True)
-            if response.status_code == 200:
-                with open(filepath, 'wb') as f:
-                    for chunk in response.iter_content(1024):
-                        f.write(chunk)
-                print(f"Downloaded: {filename}")
-                return filename
-            else:
-                print(f"Failed to download image {image_url}: {response.status_code}")
-                return None
+            with self.session.get(image_url, stream=True, timeout=TIMEOUT) as response:
+                if response.status_code != 200:
+                    logger.warning("Failed to download image %s: %s", image_url, response.status_code)
+                    return None
+                
+                save_stream(response, filepath)
+            logger.debug("Downloaded: %s", filename)
+            return filename
         except Exception as e:
-            print(f"Error downloading {image_url}: {e}")
+            logger.warning("Error downloading %s: %s", image_url, e)
             return None
     
-    def save_metadata(self):
-        """Save metadata to a JSON file."""
-        with open(self.metadata_file, 'w', encoding='utf-8') as f:
-            json.dump(self.metadata, f, indent=2, ensure_ascii=False)
-        print(f"Metadata saved to {self.metadata_file}")
+    def _process_item(self, item):
+        """Download one search result and return its metadata, or None if it was skipped."""
+        if self.should_exclude_item(item):
+            logger.debug("Skipping item with excluded terms: %s", item.get('title', ['Unknown'])[0])
+            return None
+        
+        item_id = item.get('id', '')
+        title = item.get('title', ['Untitled'])[0]
+        image_url = item.get('edmPreview', [''])[0]
+        
+        if not image_url:
+            logger.debug("No image URL for item: %s", title)
+            return None
+        
+        # Claim the item and a download slot so concurrent workers never exceed max_images
+        with self._lock:
+            if item_id in self._seen_ids:
+                logger.debug("Already downloaded %s, skipping", item_id)
+                return None
+            if self._reserved >= self.max_images:
+                return None
+            self._seen_ids.add(item_id)
+            self._reserved += 1
+        
+        # Download image, waiting only if we are over the sustained rate
+        self._bucket.acquire()
+        filename = self.download_image(image_url, item_id)
+        if not filename:
+            with self._lock:
+                self._seen_ids.discard(item_id)
+                self._reserved -= 1
+            return None
+        
+        return {
+            'id': item_id,
+            'title': title,
+            'url': image_url,
+            'filename': filename,
+            'provider': item.get('dataProvider', ['Unknown'])[0],
+            'source': item.get('guid', ''),
+            'rights': item.get('rights', []),
+            'description': item.get('dcDescription', []),
+            'creator': item.get('dcCreator', []),
+            'date': item.get('year', [])
+        }
     
     def run(self):
         """Run the scraper to download cloud images from Europeana."""
-        print(f"Starting Europeana Cloud Image Scraper")
-        print(f"Searching for: {self.search_term}")
-        print(f"Excluding: {', '.join(self.excluded_terms)}")
+        logger.info("Starting Europeana Cloud Image Scraper")
+        logger.info("Searching for: %s", self.search_term)
+        logger.info("Excluding: %s", ', '.join(self.excluded_terms))
+        
+        # Items recorded by an earlier run are skipped; new ones are appended
+        self._seen_ids = load_jsonl_ids(self.metadata_file, 'id')
         
         downloaded_count = 0
         page = 1
         
-        while downloaded_count < self.max_images:
-            data = self.search_europeana(page)
-            
-            if not data or 'items' not in data or not data['items']:
-                print("No more results or API error")
-                break
-            
-            total_results = data.get('totalResults', 0)
-            print(f"Found {total_results} total results")
-            
-            items = data['items']
-            print(f"Processing {len(items)} items from page {page}")
-            
-            for item in items:
-                if downloaded_count >= self.max_images:
+        with MetadataWriter(self.metadata_file) as metadata_writer, \
+                ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while downloaded_count < self.max_images:
+                response = self.search_europeana(page)
+                
+                if response is None:
+                    logger.info("No more results or API error")
                     break
                 
-                if self.should_exclude_item(item):
-                    print(f"Skipping item with excluded terms: {item.get('title', ['Unknown'])[0]}")
-                    continue
+                # Items are handed to the download workers as soon as they are parsed off the wire
+                logger.info("Processing items from page %s", page)
+                futures = []
+                item_count = 0
+                for item in self.iter_items(response):
+                    item_count += 1
+                    # Stop handing out work once every remaining download slot is claimed
+                    if self._reserved < self.max_images:
+                        futures.append(executor.submit(self._process_item, item))
                 
-                item_id = item.get('id', '')
-                title = item.get('title', ['Untitled'])[0]
-                image_url = item.get('edmPreview', [''])[0]
+                for future in futures:
+                    item_metadata = future.result()
+                    if not item_metadata:
+                        continue
+                    
+                    metadata_writer.write(item_metadata)
+                    downloaded_count += 1
+                    logger.debug("Downloaded %s/%s: %s", downloaded_count, self.max_images, item_metadata['title'])
                 
-                if not image_url:
-                    print(f"No image URL for item: {title}")
-                    continue
+                if downloaded_count >= self.max_images:
+                    break
                 
-                # Download image
-                safe_id = item_id.replace('/', '_').replace('\\', '_')
-                filename = f"{safe_id}.jpg"
+                if not item_count:
+                    logger.info("No more results or API error")
+                    break
                 
-                try:
-                    # Use requests instead of async for simplicity
-                    response = requests.get(image_url, stream=True)
-                    if response.status_code == 200:
-                        filepath = self.output_dir / filename
-                        with open(filepath, 'wb') as f:
-                            for chunk in response.iter_content(1024):
-                                f.write(chunk)
-                        
-                        # Store metadata
-                        item_metadata = {
-                            'id': item_id,
-                            'title': title,
-                            'url': image_url,
-                            'filename': filename,
-                            'provider': item.get('dataProvider', ['Unknown'])[0],
-                            'source': item.get('guid', ''),
-                            'rights': item.get('rights', []),
-                            'description': item.get('dcDescription', []),
-                            'creator': item.get('dcCreator', []),
-                            'date': item.get('year', [])
-                        }
-                        
-                        self.metadata.append(item_metadata)
-                        downloaded_count += 1
-                        
-                        print(f"Downloaded {downloaded_count}/{self.max_images}: {title}")
-                        
-                        # Respect rate limits
-                        time.sleep(0.5)
-                    else:
-                        print(f"Failed to download image for {title}: {response.status_code}")
-                except Exception as e:
-                    print(f"Error downloading image for {title}: {e}")
-            
-            # Save metadata periodically
-            if downloaded_count % 20 == 0:
-                self.save_metadata()
-            
-            # Check if there are more pages
-            if len(items) < self.rows_per_page:
-                print("Reached last page of results")
-                break
-            
-            page += 1
+                # Check if there are more pages
+                if item_count < self.rows_per_page:
+                    logger.info("Reached last page of results")
+                    break
+                
+                page += 1
         
-        # Final save of metadata
-        self.save_metadata()
-        print(f"Download complete. Downloaded {downloaded_count} images.")
+        logger.info("Metadata saved to %s", self.metadata_file)
+        logger.info("Download complete. Downloaded %s images.", downloaded_count)
 
 
 def main():
@@ -206,8 +235,11 @@ def main():
                         help='Directory to save downloaded images')
     parser.add_argument('--max-images', type=int, default=1000,
                         help='Maximum number of images to download')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Log every image, not just progress')
     
     args = parser.parse_args()
+    setup_logging(logging.DEBUG if args.verbose else logging.INFO)
     
     scraper = EuropeanaCloudScraper(args.api_key, args.output_dir)
     scraper.max_images = args.max_images
@@ -15,22 +15,45 @@ Variables to configure:
 """
 
 import os
-import json
-import time
+import logging
 import argparse
+import threading
+import orjson
 import requests
 from concurrent.futures import ThreadPoolExecutor
+from common_scraper import (
+    SESSION, TIMEOUT, MAX_WORKERS, TokenBucket, MetadataWriter, download_image, load_jsonl_ids,
+    compile_excluded_terms, find_excluded_term, list_downloaded_files, setup_logging, warm_up
+)
+
+logger = logging.getLogger(__name__)
 
 # Configure variables here
 API_KEY = "YOUR_API_KEY"  # Replace with your Harvard Art Museums API key
 SEARCH_TERMS = ["cloud", "sky", "weather", "mist", "fog", "atmosphere"]
 EXCLUDED_TERMS = ["saint cloud", "saint-cloud", "st cloud", "st. cloud"]
+EXCLUDE_FIELDS = ("title", "description", "culture", "dated", "people")  # Fields searched for excluded terms
 MAX_RESULTS = 100  # Maximum results per search term
 OUTPUT_DIR = "harvard_data"
 
 # API endpoints
 API_BASE = "https://api.harvardartmuseums.org"
 OBJECT_ENDPOINT = f"{API_BASE}/object"
+IMAGE_BASE = "https://nrs.harvard.edu"  # Host serving primary and additional images
+
+# Per-host rate limits shared by all worker threads: bursts go out at once, sustained rate is capped
+API_BUCKET = TokenBucket(rate=2, capacity=5)  # api.harvardartmuseums.org
+IMAGE_BUCKET = TokenBucket(rate=10, capacity=20)  # Harvard image delivery service
+
+# Excluded terms compiled into one automaton; rebuilt if --exclude is given
+EXCLUDE_AUTOMATON = compile_excluded_terms(EXCLUDED_TERMS)
+
+# IDs of objects recorded by earlier runs or already claimed in this one, across all search terms
+SEEN_IDS = set()
+SEEN_LOCK = threading.Lock()
+
+# Image files already on disk from earlier runs, listed once at startup
+DOWNLOADED_IMAGES = set()
 
 def parse_arguments():
     """Parse command line arguments"""
@@ -40,16 +63,20 @@ def parse_arguments():
     parser.add_argument("--exclude", type=str, help="Comma-separated terms to exclude")
     parser.add_argument("--max", type=int, help="Maximum results per term")
     parser.add_argument("--output", type=str, help="Output directory")
+    parser.add_argument("--verbose", action="store_true", help="Log every object, not just progress")
     args = parser.parse_args()
     
+    setup_logging(logging.DEBUG if args.verbose else logging.INFO)
+    
     # Update global variables if arguments provided
-    global API_KEY, SEARCH_TERMS, EXCLUDED_TERMS, MAX_RESULTS, OUTPUT_DIR
+    global API_KEY, SEARCH_TERMS, EXCLUDED_TERMS, EXCLUDE_AUTOMATON, MAX_RESULTS, OUTPUT_DIR
     if args.key:
         API_KEY = args.key
     if args.terms:
         SEARCH_TERMS = args.terms.split(",")
     if args.exclude:
         EXCLUDED_TERMS = args.exclude.split(",")
+        EXCLUDE_AUTOMATON = compile_excluded_terms(EXCLUDED_TERMS)
     if args.max:
         MAX_RESULTS = args.max
     if args.output:
@@ -57,22 +84,12 @@ def parse_arguments():
 
 def setup_directories():
     """Create necessary directories for storing data"""
-    # Main output directory
-    if not os.path.exists(OUTPUT_DIR):
-        os.makedirs(OUTPUT_DIR)
-        print(f"Created directory: {OUTPUT_DIR}")
-    
-    # Images directory
     images_dir = os.path.join(OUTPUT_DIR, "images")
-    if not os.path.exists(images_dir):
-        os.makedirs(images_dir)
-        print(f"Created directory: {images_dir}")
-    
-    # Metadata directory
     metadata_dir = os.path.join(OUTPUT_DIR, "metadata")
-    if not os.path.exists(metadata_dir):
-        os.makedirs(metadata_dir)
-        print(f"Created directory: {metadata_dir}")
+    
+    # makedirs creates OUTPUT_DIR along the way and tolerates existing directories
+    os.makedirs(images_dir, exist_ok=True)
+    os.makedirs(metadata_dir, exist_ok=True)
     
     return images_dir, metadata_dir
 
@@ -98,11 +115,12 @@ def search_harvard(term, page=1, has_image=True):
     }
     
     try:
-        response = requests.get(OBJECT_ENDPOINT, params=params)
+        API_BUCKET.acquire()
+        response = SESSION.get(OBJECT_ENDPOINT, params=params, timeout=TIMEOUT)
         response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error searching for '{term}': {e}")
+        return orjson.loads(response.content)
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
+        logger.error("Error searching for '%s': %s", term, e)
         return None
 
 def should_exclude(metadata):
@@ -110,43 +128,31 @@ def should_exclude(metadata):
     if not metadata:
         return True
     
-    # Convert metadata to string for simple term matching
-    metadata_str = json.dumps(metadata).lower()
+    # Match against the descriptive fields only, not the whole serialized record
+    haystack = " ".join(str(metadata.get(field) or "") for field in EXCLUDE_FIELDS).lower()
     
-    for term in EXCLUDED_TERMS:
-        if term.lower() in metadata_str:
-            print(f"Excluding object {metadata.get('id')} because it contains '{term}'")
-            return True
+    term = find_excluded_term(EXCLUDE_AUTOMATON, haystack)
+    if term:
+        logger.debug("Excluding object %s because it contains '%s'", metadata.get('id'), term)
+        return True
     
     return False
 
-def download_image(url, filepath):
-    """Download an image from a URL and save it to a file"""
-    try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        
-        with open(filepath, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        
-        return True
-    except Exception as e:
-        print(f"Error downloading image: {e}")
-        return False
-
-def process_object(art_object, images_dir, metadata_dir):
+def process_object(art_object, images_dir, metadata_writer):
     """Process a single artwork: download images and save metadata"""
     # Extract basic information
     object_id = art_object.get("id")
     if not object_id:
         return False
     
-    # Check if already downloaded
-    metadata_path = os.path.join(metadata_dir, f"{object_id}.json")
-    if os.path.exists(metadata_path):
-        print(f"Already processed {object_id}, skipping")
-        return True
+    # Claim the object before any work so a match from another search term isn't fetched twice
+    with SEEN_LOCK:
+        already_seen = str(object_id) in SEEN_IDS
+        SEEN_IDS.add(str(object_id))
+    if already_seen:
+        # Not counted toward MAX_RESULTS: it was handled, or excluded, under another term or run
+        logger.debug("Already processed %s, skipping", object_id)
+        return False
     
     # Check if object contains excluded terms
     if should_exclude(art_object):
@@ -162,12 +168,17 @@ def process_object(art_object, images_dir, metadata_dir):
         if not ext:
             ext = ".jpg"  # Default extension
         
-        image_path = os.path.join(images_dir, f"{object_id}{ext}")
-        success = download_image(primary_image_url, image_path)
-        if not success:
-            print(f"Failed to download image for {object_id}")
+        image_name = f"{object_id}{ext}"
+        if image_name not in DOWNLOADED_IMAGES:
+            success = download_image(primary_image_url, os.path.join(images_dir, image_name), bucket=IMAGE_BUCKET)
+            if not success:
+                logger.warning("Failed to download image for %s", object_id)
+                # Release the claim and leave it unrecorded so another term or run retries it
+                with SEEN_LOCK:
+                    SEEN_IDS.discard(str(object_id))
+                return False
     else:
-        print(f"No image available for {object_id}")
+        logger.debug("No image available for %s", object_id)
         return False
     
     # Process additional images
@@ -176,81 +187,96 @@ def process_object(art_object, images_dir, metadata_dir):
             if "baseimageurl" in img:
                 img_url = img["baseimageurl"]
                 img_ext = os.path.splitext(img_url)[1] or ".jpg"
-                img_path = os.path.join(images_dir, f"{object_id}_additional_{i+1}{img_ext}")
-                download_image(img_url, img_path)
+                img_name = f"{object_id}_additional_{i+1}{img_ext}"
+                if img_name not in DOWNLOADED_IMAGES:
+                    download_image(img_url, os.path.join(images_dir, img_name), bucket=IMAGE_BUCKET)
     
-    # Save metadata
-    with open(metadata_path, 'w', encoding='utf-8') as f:
-        json.dump(art_object, f, indent=2)
+    # Queue metadata as one JSONL record; the writer thread serializes it and does the disk I/O
+    metadata_writer.write(art_object)
     
-    print(f"Successfully processed {object_id}")
+    logger.debug("Successfully processed %s", object_id)
     return True
 
-def search_and_download(term, images_dir, metadata_dir):
-    """Search for artworks matching the term and download them"""
-    print(f"Searching for term: {term}")
+def search_and_download(term, images_dir, metadata_writer, executor):
+    """Search for artworks matching the term and download them using the shared executor"""
+    logger.info("Searching for term: %s", term)
     
     processed_count = 0
     page = 1
     
+    # Search for the first page of objects
+    search_results = search_harvard(term, page=page)
+    
     while processed_count < MAX_RESULTS:
-        # Search for objects
-        search_results = search_harvard(term, page=page)
-        
         if not search_results or "records" not in search_results or not search_results["records"]:
-            print(f"No more results for '{term}' or error in API response")
+            logger.info("No more results for '%s' or error in API response", term)
             break
         
         objects = search_results["records"]
         if not objects:
             break
         
-        print(f"Found {len(objects)} results for '{term}' on page {page}")
+        logger.info("Found %s results for '%s' on page %s", len(objects), term, page)
+        
+        # Fetch the next page while this page's downloads are in flight
+        next_page = None
+        if len(objects) == 100:
+            next_page = executor.submit(search_harvard, term, page=page + 1)
         
         # Process each object
-        successful = 0
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            results = list(executor.map(
-                lambda obj: process_object(obj, images_dir, metadata_dir),
-                objects
-            ))
-            successful = sum(1 for result in results if result)
+        results = list(executor.map(
+            lambda obj: process_object(obj, images_dir, metadata_writer),
+            objects
+        ))
+        successful = sum(1 for result in results if result)
         
         processed_count += successful
         page += 1
         
         # Check if we've reached the last page or max results
-        if len(objects) < 100 or processed_count >= MAX_RESULTS:
+        if next_page is None or processed_count >= MAX_RESULTS:
             break
         
-        # Be nice to the API
-        time.sleep(1)
+        search_results = next_page.result()
     
-    print(f"Completed search for '{term}'. Successfully processed {processed_count} objects.")
+    logger.info("Completed search for '%s'. Successfully processed %s objects.", term, processed_count)
     return processed_count
 
 def main():
     """Main function to run the scraper"""
     parse_arguments()
     
-    print(f"Harvard Art Museums Cloud Image Scraper")
-    print(f"API Key: {API_KEY[:5]}[...]")
-    print(f"Search Terms: {', '.join(SEARCH_TERMS)}")
-    print(f"Excluded Terms: {', '.join(EXCLUDED_TERMS)}")
-    print(f"Max Results per Term: {MAX_RESULTS}")
-    print(f"Output Directory: {OUTPUT_DIR}")
+    logger.info("Harvard Art Museums Cloud Image Scraper")
+    logger.info("API Key: %s[...]", API_KEY[:5])
+    logger.info("Search Terms: %s", ', '.join(SEARCH_TERMS))
+    logger.info("Excluded Terms: %s", ', '.join(EXCLUDED_TERMS))
+    logger.info("Max Results per Term: %s", MAX_RESULTS)
+    logger.info("Output Directory: %s", OUTPUT_DIR)
     
     if API_KEY == "YOUR_API_KEY":
-        print("Please provide a valid API key with --key or by editing the script.")
+        logger.error("Please provide a valid API key with --key or by editing the script.")
         return
     
     # Setup directories
     images_dir, metadata_dir = setup_directories()
+    DOWNLOADED_IMAGES.update(list_downloaded_files(images_dir))
+    
+    # All metadata goes to one append-only JSONL file
+    metadata_path = os.path.join(metadata_dir, "metadata.jsonl")
+    SEEN_IDS.update(load_jsonl_ids(metadata_path, "id"))
+    
+    # Also count objects saved as <id>.json by earlier versions of this script
+    SEEN_IDS.update(
+        os.path.splitext(name)[0] for name in os.listdir(metadata_dir) if name.endswith(".json")
+    )
+    
+    # The first search connects to the API host; connect to the image host before the workers race for it
+    warm_up(SESSION, [IMAGE_BASE])
     
-    # Process each search term
+    # Process each search term, sharing one worker pool across all pages and terms
     total_objects = 0
-    for term in SEARCH_TERMS:
-        objects_processed = search_and_download(term, images_dir, metadata_dir)
-        total_objects += objects_processed
-        # Be nice to the API
-        time.sleep(2)
+    with MetadataWriter(metadata_path) as metadata_writer, \
+            ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for term in SEARCH_TERMS:
+            objects_processed = search_and_download(term, images_dir, metadata_writer, executor)
+            total_objects += objects_processed
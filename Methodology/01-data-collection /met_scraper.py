@@ -15,15 +15,24 @@ Variables to configure:
 """
 
 import os
-import json
-import time
+import logging
 import argparse
+import threading
+import ijson
+import orjson
 import requests
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from common_scraper import (
+    SESSION, TIMEOUT, MAX_WORKERS, TokenBucket, MetadataWriter, download_image, load_jsonl_ids,
+    compile_excluded_terms, find_excluded_term, list_downloaded_files, setup_logging, warm_up
+)
+
+logger = logging.getLogger(__name__)
 
 # Configure variables here
 SEARCH_TERMS = ["cloud", "sky", "weather", "mist", "fog", "atmosphere"]
 EXCLUDED_TERMS = ["saint cloud", "saint-cloud", "st cloud", "st. cloud"]
+EXCLUDE_FIELDS = ("title", "culture", "artistDisplayName", "objectName", "medium", "tags")  # Fields searched for excluded terms
 MAX_RESULTS = 100  # Maximum results per search term
 OUTPUT_DIR = "met_data"
 
@@ -31,6 +40,21 @@ OUTPUT_DIR = "met_data"
 API_BASE = "https://collectionapi.metmuseum.org/public/collection/v1"
 SEARCH_ENDPOINT = f"{API_BASE}/search"
 OBJECT_ENDPOINT = f"{API_BASE}/objects"
+IMAGE_BASE = "https://images.metmuseum.org"  # Host serving primary and additional images
+
+# Per-host rate limits shared by all worker threads: bursts go out at once, sustained rate is capped
+API_BUCKET = TokenBucket(rate=80, capacity=80)  # collectionapi.metmuseum.org asks for at most 80 req/s
+IMAGE_BUCKET = TokenBucket(rate=20, capacity=40)  # images.metmuseum.org
+
+# Excluded terms compiled into one automaton; rebuilt if --exclude is given
+EXCLUDE_AUTOMATON = compile_excluded_terms(EXCLUDED_TERMS)
+
+# IDs of objects recorded by earlier runs or already claimed in this one, across all search terms
+SEEN_IDS = set()
+SEEN_LOCK = threading.Lock()
+
+# Image files already on disk from earlier runs, listed once at startup
+DOWNLOADED_IMAGES = set()
 
 def parse_arguments():
     """Parse command line arguments"""
@@ -39,14 +63,18 @@ def parse_arguments():
     parser.add_argument("--exclude", type=str, help="Comma-separated terms to exclude")
     parser.add_argument("--max", type=int, help="Maximum results per term")
     parser.add_argument("--output", type=str, help="Output directory")
+    parser.add_argument("--verbose", action="store_true", help="Log every object, not just progress")
     args = parser.parse_args()
     
+    setup_logging(logging.DEBUG if args.verbose else logging.INFO)
+    
     # Update global variables if arguments provided
-    global SEARCH_TERMS, EXCLUDED_TERMS, MAX_RESULTS, OUTPUT_DIR
+    global SEARCH_TERMS, EXCLUDED_TERMS, EXCLUDE_AUTOMATON, MAX_RESULTS, OUTPUT_DIR
     if args.terms:
         SEARCH_TERMS = args.terms.split(",")
     if args.exclude:
         EXCLUDED_TERMS = args.exclude.split(",")
+        EXCLUDE_AUTOMATON = compile_excluded_terms(EXCLUDED_TERMS)
     if args.max:
         MAX_RESULTS = args.max
     if args.output:
@@ -54,32 +82,23 @@ def parse_arguments():
 
 def setup_directories():
     """Create necessary directories for storing data"""
-    # Main output directory
-    if not os.path.exists(OUTPUT_DIR):
-        os.makedirs(OUTPUT_DIR)
-        print(f"Created directory: {OUTPUT_DIR}")
-    
-    # Images directory
     images_dir = os.path.join(OUTPUT_DIR, "images")
-    if not os.path.exists(images_dir):
-        os.makedirs(images_dir)
-        print(f"Created directory: {images_dir}")
-    
-    # Metadata directory
     metadata_dir = os.path.join(OUTPUT_DIR, "metadata")
-    if not os.path.exists(metadata_dir):
-        os.makedirs(metadata_dir)
-        print(f"Created directory: {metadata_dir}")
+    
+    # makedirs creates OUTPUT_DIR along the way and tolerates existing directories
+    os.makedirs(images_dir, exist_ok=True)
+    os.makedirs(metadata_dir, exist_ok=True)
     
     return images_dir, metadata_dir
 
-def search_met(term, has_images=True):
+def search_met(term, has_images=True, max_results=None):
     """
     Search the Met collection for a specific term
     
     Args:
         term: Search term
         has_images: Only return results with images
+        max_results: Stop reading the response after this many IDs
     
     Returns:
         List of object IDs matching the search
@@ -90,18 +109,30 @@ def search_met(term, has_images=True):
     }
     
     try:
-        response = requests.get(SEARCH_ENDPOINT, params=params)
-        response.raise_for_status()
-        data = response.json()
+        API_BUCKET.acquire()
+        with SESSION.get(SEARCH_ENDPOINT, params=params, stream=True, timeout=TIMEOUT) as response:
+            response.raise_for_status()
+            # Broad terms match tens of thousands of objects; parse the ID array
+            # off the wire and stop once we have as many as we will use
+            response.raw.decode_content = True
+            total = 0
+            object_ids = []
+            for prefix, event, value in ijson.parse(response.raw):
+                if prefix == "total":
+                    total = value
+                elif prefix == "objectIDs.item":
+                    object_ids.append(value)
+                    if max_results is not None and len(object_ids) >= max_results:
+                        break
         
-        if "objectIDs" in data and data["objectIDs"]:
-            print(f"Found {len(data['objectIDs'])} results for '{term}'")
-            return data["objectIDs"]
+        if object_ids:
+            logger.info("Found %s results for '%s'", total or len(object_ids), term)
+            return object_ids
         else:
-            print(f"No results found for '{term}'")
+            logger.info("No results found for '%s'", term)
             return []
-    except requests.exceptions.RequestException as e:
-        print(f"Error searching for '{term}': {e}")
+    except (requests.exceptions.RequestException, ijson.JSONError) as e:
+        logger.error("Error searching for '%s': %s", term, e)
         return []
 
 def get_object_details(object_id):
@@ -117,11 +148,12 @@ def get_object_details(object_id):
     url = f"{OBJECT_ENDPOINT}/{object_id}"
     
     try:
-        response = requests.get(url)
+        API_BUCKET.acquire()
+        response = SESSION.get(url, timeout=TIMEOUT)
         response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error getting details for object {object_id}: {e}")
+        return orjson.loads(response.content)
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
+        logger.warning("Error getting details for object %s: %s", object_id, e)
         return None
 
 def should_exclude(metadata):
@@ -129,131 +161,152 @@ def should_exclude(metadata):
     if not metadata:
         return True
     
-    # Convert metadata to string for simple term matching
-    metadata_str = json.dumps(metadata).lower()
+    # Match against the descriptive fields only, not the whole serialized record
+    haystack = " ".join(str(metadata.get(field) or "") for field in EXCLUDE_FIELDS).lower()
     
-    for term in EXCLUDED_TERMS:
-        if term.lower() in metadata_str:
-            print(f"Excluding object {metadata.get('objectID')} because it contains '{term}'")
-            return True
+    term = find_excluded_term(EXCLUDE_AUTOMATON, haystack)
+    if term:
+        logger.debug("Excluding object %s because it contains '%s'", metadata.get('objectID'), term)
+        return True
     
     return False
 
-def download_image(url, filepath):
-    """Download an image from a URL and save it to a file"""
-    try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        
-        with open(filepath, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        
-        return True
-    except Exception as e:
-        print(f"Error downloading image: {e}")
-        return False
-
-def process_object(object_id, images_dir, metadata_dir):
-    """Process a single artwork: download images and save metadata"""
-    # Check if already downloaded
-    metadata_path = os.path.join(metadata_dir, f"{object_id}.json")
-    if os.path.exists(metadata_path):
-        print(f"Already processed {object_id}, skipping")
-        return True
-    
-    # Get detailed information
-    object_details = get_object_details(object_id)
-    if not object_details:
-        return False
-    
-    # Check if object contains excluded terms
-    if should_exclude(object_details):
-        return False
-    
+def queue_images(object_id, object_details, images_dir, image_pool):
+    """Submit an artwork's image downloads and return (primary_future, additional_futures); primary_future is None if there is nothing to fetch"""
     # Extract image URLs
     primary_image = object_details.get("primaryImage")
     additional_images = object_details.get("additionalImages", [])
     
-    # Download primary image if available
+    def submit(url, name):
+        # Skip images a previous run already saved
+        if name in DOWNLOADED_IMAGES:
+            return None
+        return image_pool.submit(download_image, url, os.path.join(images_dir, name), bucket=IMAGE_BUCKET)
+    
+    # Primary image, if available
+    primary_future = None
     if primary_image:
         # Determine file extension
         ext = os.path.splitext(primary_image)[1]
         if not ext:
             ext = ".jpg"  # Default extension
-        
-        image_path = os.path.join(images_dir, f"{object_id}{ext}")
-        success = download_image(primary_image, image_path)
-        if not success:
-            print(f"Failed to download primary image for {object_id}")
+        primary_future = submit(primary_image, f"{object_id}{ext}")
     
-    # Download additional images if available (optional)
-    for i, img_url in enumerate(additional_images[:5]):  # Limit to first 5 additional images
+    # Then the first 5 additional images
+    additional_futures = []
+    for i, img_url in enumerate(additional_images[:5]):
         if img_url:
-            # Determine file extension
             ext = os.path.splitext(img_url)[1]
             if not ext:
                 ext = ".jpg"
-            
-            img_path = os.path.join(images_dir, f"{object_id}_additional_{i+1}{ext}")
-            download_image(img_url, img_path)
+            future = submit(img_url, f"{object_id}_additional_{i+1}{ext}")
+            if future:
+                additional_futures.append(future)
     
-    # Save metadata
-    with open(metadata_path, 'w', encoding='utf-8') as f:
-        json.dump(object_details, f, indent=2)
-    
-    print(f"Successfully processed {object_id}")
-    return True
+    return primary_future, additional_futures
 
-def search_and_download(term, images_dir, metadata_dir):
-    """Search for artworks matching the term and download them"""
-    print(f"Searching for term: {term}")
-    
-    # Search for objects
-    object_ids = search_met(term)
+def search_and_download(term, images_dir, metadata_writer, detail_pool, image_pool):
+    """Search for artworks matching the term, overlapping detail lookups with image downloads"""
+    logger.info("Searching for term: %s", term)
     
-    # Limit results
-    object_ids = object_ids[:MAX_RESULTS]
+    # Search for objects, reading no more IDs than MAX_RESULTS
+    object_ids = search_met(term, max_results=MAX_RESULTS)
     
     if not object_ids:
         return 0
     
-    print(f"Processing {len(object_ids)} objects for term '{term}'")
+    logger.info("Processing %s objects for term '%s'", len(object_ids), term)
     
-    # Process each object
+    # Fetch details for every object not seen yet, claiming each so a match
+    # from another search term isn't fetched twice
     successful = 0
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        results = list(executor.map(
-            lambda obj_id: process_object(obj_id, images_dir, metadata_dir),
-            object_ids
-        ))
-        successful = sum(1 for result in results if result)
+    detail_futures = {}
+    with SEEN_LOCK:
+        for object_id in object_ids:
+            if str(object_id) in SEEN_IDS:
+                # Not counted: it was handled, or excluded, under another term or run
+                logger.debug("Already processed %s, skipping", object_id)
+            else:
+                SEEN_IDS.add(str(object_id))
+                detail_futures[detail_pool.submit(get_object_details, object_id)] = object_id
     
-    print(f"Completed search for '{term}'. Successfully processed {successful} objects.")
+    # Queue each object's images as soon as its details arrive, so downloads
+    # overlap with the detail requests still in flight
+    pending = []
+    for future in as_completed(detail_futures):
+        object_id = detail_futures[future]
+        object_details = future.result()
+        
+        # A failed lookup releases the claim so a later search term can try this object again
+        if not object_details:
+            with SEEN_LOCK:
+                SEEN_IDS.discard(str(object_id))
+            continue
+        
+        # Check if object contains excluded terms
+        if should_exclude(object_details):
+            continue
+        
+        pending.append((object_id, object_details, *queue_images(object_id, object_details, images_dir, image_pool)))
+    
+    # Save metadata once an object's images are on disk
+    for object_id, object_details, primary_future, additional_futures in pending:
+        # Wait for every download, even when the primary failed, before moving on
+        additional_ok = all([image_future.result() for image_future in additional_futures])
+        if primary_future and not primary_future.result():
+            logger.warning("Failed to download image for %s", object_id)
+            # Release the claim and leave it unrecorded so another term or run retries it
+            with SEEN_LOCK:
+                SEEN_IDS.discard(str(object_id))
+            continue
+        if not additional_ok:
+            logger.warning("Failed to download some additional images for %s", object_id)
+        
+        # Queue metadata as one JSONL record; the writer thread serializes it and does the disk I/O
+        metadata_writer.write(object_details)
+        
+        logger.debug("Successfully processed %s", object_id)
+        successful += 1
+    
+    logger.info("Completed search for '%s'. Successfully processed %s objects.", term, successful)
     return successful
 
 def main():
     """Main function to run the scraper"""
     parse_arguments()
     
-    print(f"Metropolitan Museum of Art Cloud Image Scraper")
-    print(f"Search Terms: {', '.join(SEARCH_TERMS)}")
-    print(f"Excluded Terms: {', '.join(EXCLUDED_TERMS)}")
-    print(f"Max Results per Term: {MAX_RESULTS}")
-    print(f"Output Directory: {OUTPUT_DIR}")
+    logger.info("Metropolitan Museum of Art Cloud Image Scraper")
+    logger.info("Search Terms: %s", ', '.join(SEARCH_TERMS))
+    logger.info("Excluded Terms: %s", ', '.join(EXCLUDED_TERMS))
+    logger.info("Max Results per Term: %s", MAX_RESULTS)
+    logger.info("Output Directory: %s", OUTPUT_DIR)
     
     # Setup directories
     images_dir, metadata_dir = setup_directories()
+    DOWNLOADED_IMAGES.update(list_downloaded_files(images_dir))
+    
+    # All metadata goes to one append-only JSONL file
+    metadata_path = os.path.join(metadata_dir, "metadata.jsonl")
+    SEEN_IDS.update(load_jsonl_ids(metadata_path, "objectID"))
+    
+    # Also count objects saved as <id>.json by earlier versions of this script
+    SEEN_IDS.update(
+        os.path.splitext(name)[0] for name in os.listdir(metadata_dir) if name.endswith(".json")
+    )
+    
+    # The first search connects to the API host; connect to the image host before the workers race for it
+    warm_up(SESSION, [IMAGE_BASE])
     
-    # Process each search term
+    # Process each search term, with separate pools for detail lookups and image downloads
     total_objects = 0
-    for term in SEARCH_TERMS:
-        objects_processed = search_and_download(term, images_dir, metadata_dir)
-        total_objects += objects_processed
-        # Be nice to the API
-        time.sleep(1)
+    with MetadataWriter(metadata_path) as metadata_writer, \
+            ThreadPoolExecutor(max_workers=MAX_WORKERS) as detail_pool, \
+            ThreadPoolExecutor(max_workers=MAX_WORKERS) as image_pool:
+        for term in SEARCH_TERMS:
+            objects_processed = search_and_download(term, images_dir, metadata_writer, detail_pool, image_pool)
+            total_objects += objects_processed
     
-    print(f"Scraping complete. Total objects processed: {total_objects}")
+    logger.info("Scraping complete. Total objects processed: %s", total_objects)
 
 if __name__ == "__main__":
     main()
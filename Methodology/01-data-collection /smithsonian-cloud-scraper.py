@@ -1,9 +1,12 @@
 import os
-import json
-import time
-import requests
+import re
+import logging
+import orjson
 from dotenv import load_dotenv
 from urllib.parse import urlencode
+from common_scraper import SESSION, TIMEOUT, TokenBucket, MetadataWriter, download_image, load_jsonl_ids, setup_logging
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables from .env file
 load_dotenv()
@@ -13,10 +16,20 @@ API_KEY = os.getenv('SMITHSONIAN_API_KEY', 'YOUR_API_KEY_HERE')
 BASE_URL = 'https://api.si.edu/openaccess/api/v1.0'
 SEARCH_ENDPOINT = '/search'
 
+# Per-host rate limits: bursts go out at once, sustained rate is capped
+API_BUCKET = TokenBucket(rate=1, capacity=5)  # api.si.edu
+IMAGE_BUCKET = TokenBucket(rate=10, capacity=20)  # ids.si.edu
+
+# Image requests are sent with a browser User-Agent
+IMAGE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
 # Create directories for saving data
 OUTPUT_DIR = os.path.join(os.path.dirname(__file__), 'smithsonian_clouds')
 IMAGES_DIR = os.path.join(OUTPUT_DIR, 'images')
 METADATA_DIR = os.path.join(OUTPUT_DIR, 'metadata')
+METADATA_PATH = os.path.join(METADATA_DIR, 'metadata.jsonl')
 
 # Ensure directories exist
 os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -51,7 +64,7 @@ def has_downloadable_image(item):
                 return True
         return False
     except Exception as e:
-        print(f"Error checking for downloadable image: {e}")
+        logger.warning("Error checking for downloadable image: %s", e)
         return False
 
 def is_from_nmnh(item):
@@ -89,42 +102,18 @@ def get_image_url(item):
                 
         return None, None
     except Exception as e:
-        print(f"Error getting image URL: {e}")
+        logger.warning("Error getting image URL: %s", e)
         return None, None
 
+# Anything but letters, digits and underscore; matches the old per-character isalnum() check
+NON_ALNUM_RE = re.compile(r'\W')
+
 def clean_filename(title):
     """Clean a string to make it suitable for a filename."""
     if not title:
         return 'unknown'
-    # Replace non-alphanumeric characters with underscores
-    clean = ''.join(c if c.isalnum() else '_' for c in title)
-    # Ensure it's not too long
-    return clean.lower()[:100]
-
-def download_image(url, filename, rights):
-    """Download an image from URL to a file."""
-    try:
-        print(f"Attempting to download: {url} (Rights: {rights})")
-        
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
-        response = requests.get(url, stream=True, headers=headers)
-        response.raise_for_status()
-        
-        # Add .jpg extension if not present
-        if not filename.lower().endswith('.jpg'):
-            filename = f"{filename}.jpg"
-        
-        with open(filename, 'wb') as file:
-            for chunk in response.iter_content(chunk_size=8192):
-                file.write(chunk)
-        print(f"Successfully downloaded to: {filename}")
-        return True
-    except Exception as e:
-        print(f"Error downloading image {url}: {e}")
-        return False
+    # Replace non-alphanumeric characters with underscores, ensuring it's not too long
+    return NON_ALNUM_RE.sub('_', title).lower()[:100]
 
 def search_and_download():
     """Main function to search and download images and metadata."""
@@ -136,98 +125,103 @@ def search_and_download():
     successful_downloads = 0
     nmnh_excluded = 0
     
-    print('Starting to search for cloud images (excluding saint cloud/saint-cloud and National Museum of Natural History)...')
-    print(f"Using API key: {API_KEY[:5]}...{API_KEY[-5:] if len(API_KEY) > 10 else ''}")
-    print(f"Output directory: {OUTPUT_DIR}")
+    logger.info('Starting to search for cloud images (excluding saint cloud/saint-cloud and National Museum of Natural History)...')
+    logger.info("Using API key: %s...%s", API_KEY[:5], API_KEY[-5:] if len(API_KEY) > 10 else '')
+    logger.info("Output directory: %s", OUTPUT_DIR)
     
-    while has_more_results:
-        try:
-            # Update start index for pagination
-            search_params['start'] = start_index
-            
-            # Construct query URL
-            params = {
-                'api_key': API_KEY,
-                **search_params
-            }
-            query_string = urlencode(params)
-            url = f"{BASE_URL}{SEARCH_ENDPOINT}?{query_string}"
+    # Only the start index changes between pages, so encode the rest of the query once
+    params = {
+        'api_key': API_KEY,
+        **{key: value for key, value in search_params.items() if key != 'start'}
+    }
+    url_template = f"{BASE_URL}{SEARCH_ENDPOINT}?{urlencode(params)}&start={{}}"
+    
+    # Items recorded by an earlier run are skipped; new ones are appended as JSONL records
+    processed_ids = load_jsonl_ids(METADATA_PATH, 'id')
+    
+    with MetadataWriter(METADATA_PATH) as metadata_writer:
+        while has_more_results:
+            try:
+                # Construct query URL for the current page
+                url = url_template.format(start_index)
             
-            print(f"Fetching results {start_index} to {start_index + search_params['rows']}...")
+                logger.info("Fetching results %s to %s...", start_index, start_index + search_params['rows'])
             
-            # Make API request
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()
+                # Make API request
+                API_BUCKET.acquire()
+                response = SESSION.get(url, timeout=TIMEOUT)
+                response.raise_for_status()
+                data = orjson.loads(response.content)
             
-            if not data.get('response') or not data['response'].get('rows'):
-                print('No results found or unexpected API response format.')
-                break
+                if not data.get('response') or not data['response'].get('rows'):
+                    logger.info('No results found or unexpected API response format.')
+                    break
             
-            items = data['response']['rows']
-            print(f"Received {len(items)} items.")
+                items = data['response']['rows']
+                logger.info("Received %s items.", len(items))
             
-            if not items:
-                has_more_results = False
-                break
+                if not items:
+                    has_more_results = False
+                    break
             
-            # Process each item
-            for item in items:
-                # Check if the item is from NMNH (double check as API filter might not catch all)
-                if is_from_nmnh(item):
-                    nmnh_excluded += 1
-                    print(f"Excluding item from NMNH: {item.get('id', 'unknown')}")
-                    continue
-                    
-                if has_downloadable_image(item):
-                    eligible_items += 1
-                    image_url, rights = get_image_url(item)
-                    if not image_url:
-                        print(f"Could not extract image URL for item: {item.get('id', 'unknown')}")
+                # Process each item
+                for item in items:
+                    # Check if the item is from NMNH (double check as API filter might not catch all)
+                    if is_from_nmnh(item):
+                        nmnh_excluded += 1
+                        logger.debug("Excluding item from NMNH: %s", item.get('id', 'unknown'))
                         continue
                     
-                    title = item.get('title', 'untitled')
-                    item_id = item.get('id', 'unknown_id')
-                    filename = clean_filename(f"{item_id}_{title}")
+                    if has_downloadable_image(item):
+                        eligible_items += 1
+                        image_url, rights = get_image_url(item)
+                        if not image_url:
+                            logger.debug("Could not extract image URL for item: %s", item.get('id', 'unknown'))
+                            continue
                     
-                    # Save metadata to JSON file
-                    metadata_path = os.path.join(METADATA_DIR, f"{filename}.json")
-                    with open(metadata_path, 'w') as f:
-                        json.dump(item, f, indent=2)
+                        title = item.get('title', 'untitled')
+                        item_id = item.get('id', 'unknown_id')
+                        filename = clean_filename(f"{item_id}_{title}")
+                        
+                        if str(item_id) in processed_ids:
+                            logger.debug("Already processed %s, skipping", item_id)
+                            continue
                     
-                    # Download image
-                    image_path = os.path.join(IMAGES_DIR, filename)
-                    print(f"Downloading: {title} (ID: {item_id})")
-                    attempted_downloads += 1
-                    success = download_image(image_url, image_path, rights)
-                    if success:
-                        successful_downloads += 1
-                        total_processed += 1
-                else:
-                    print(f"Item does not have downloadable image: {item.get('id', 'unknown')}")
+                        # Download image; clean_filename never leaves a '.jpg' suffix, so add one
+                        image_path = os.path.join(IMAGES_DIR, f"{filename}.jpg")
+                        logger.debug("Downloading: %s (ID: %s, Rights: %s)", title, item_id, rights)
+                        attempted_downloads += 1
+                        success = download_image(image_url, image_path, bucket=IMAGE_BUCKET, headers=IMAGE_HEADERS)
+                        if success:
+                            logger.debug("Successfully downloaded to: %s", image_path)
+                            # Record the item only once its image is on disk, so failed downloads are retried next run
+                            metadata_writer.write(item)
+                            processed_ids.add(str(item_id))
+                            successful_downloads += 1
+                            total_processed += 1
+                    else:
+                        logger.debug("Item does not have downloadable image: %s", item.get('id', 'unknown'))
             
-            # Move to next page
-            start_index += len(items)
+                # Move to next page
+                start_index += len(items)
             
-            # Check if we've reached the end of results
-            if len(items) < search_params['rows']:
-                has_more_results = False
+                # Check if we've reached the end of results
+                if len(items) < search_params['rows']:
+                    has_more_results = False
             
-            # Optional delay to avoid overwhelming the API
-            time.sleep(1)
+                # Print summary after each batch
+                logger.info("Summary so far: %s eligible items, %s download attempts, %s successful downloads, %s NMNH items excluded", eligible_items, attempted_downloads, successful_downloads, nmnh_excluded)
             
-            # Print summary after each batch
-            print(f"Summary so far: {eligible_items} eligible items, {attempted_downloads} download attempts, {successful_downloads} successful downloads, {nmnh_excluded} NMNH items excluded")
-            
-        except Exception as e:
-            print(f"Error during API request: {e}")
-            break
+            except Exception as e:
+                logger.error("Error during API request: %s", e)
+                break
     
-    print(f"Finished processing.")
-    print(f"Total stats: {eligible_items} eligible items found")
-    print(f"             {attempted_downloads} download attempts")
-    print(f"             {successful_downloads} successful downloads")
-    print(f"             {nmnh_excluded} NMNH items excluded")
+    logger.info("Finished processing.")
+    logger.info("Total stats: %s eligible items found", eligible_items)
+    logger.info("             %s download attempts", attempted_downloads)
+    logger.info("             %s successful downloads", successful_downloads)
+    logger.info("             %s NMNH items excluded", nmnh_excluded)
 
 if __name__ == "__main__":
+    setup_logging()
     search_and_download()